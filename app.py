@@ -1,20 +1,26 @@
 import streamlit as st
 import os
+import errno
 import shutil
 import subprocess
 from pathlib import Path
 import uuid
-from io import BytesIO
+import tempfile
+import hashlib
 import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Setup persistent session directory
 SESSION_ID = st.session_state.get("session_id", str(uuid.uuid4()))
 st.session_state["session_id"] = SESSION_ID
-BASE_TEMP_DIR = f"temp_storage_{SESSION_ID}"
-INPUT_DIR = os.path.join(BASE_TEMP_DIR, "input")
+# Scratch space defaults to the system temp dir; point COMPRESSOR_TMP at a
+# tmpfs such as /dev/shm to keep Ghostscript I/O in memory
+TEMP_ROOT = os.environ.get("COMPRESSOR_TMP", tempfile.gettempdir())
+BASE_TEMP_DIR = os.path.join(TEMP_ROOT, f"temp_storage_{SESSION_ID}")
 OUTPUT_DIR = os.path.join(BASE_TEMP_DIR, "output")
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+CACHE_DIR = os.path.join(BASE_TEMP_DIR, "gs_cache")
+ZIP_PATH = os.path.join(BASE_TEMP_DIR, "Compressed_Structured.zip")
 
 QUALITY_MAP = {
     "Recommended": "/ebook",
@@ -26,73 +32,201 @@ DPI_FLAGS = {
     "Ultra": ["-dDownsampleColorImages=true", "-dColorImageResolution=50"]
 }
 
+# gs argv is assembled from prebuilt pieces; only the paths vary per call
+GS_ARGS = ("gs", "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4", "-dNOPAUSE", "-dQUIET", "-dBATCH")
+GS_QUALITY_ARGS = {
+    quality: (f"-dPDFSETTINGS={flag}", *DPI_FLAGS.get(quality, []))
+    for quality, flag in QUALITY_MAP.items()
+}
+
+COPY_BUFSIZE = 1024 * 1024
+
+# Concurrent gs processes; defaults to one per core
+try:
+    MAX_WORKERS = int(os.environ["PDF_COMPRESS_CONCURRENCY"])
+except (KeyError, ValueError):
+    MAX_WORKERS = os.cpu_count() or 1
+MAX_WORKERS = max(1, MAX_WORKERS)
+
+# Uploads with these extensions are unpacked into the output tree
+ARCHIVE_EXTS = frozenset({".zip"})
+
+# Formats whose contents are already compressed; deflating them again costs
+# CPU for next to no size reduction
+STORED_EXTS = frozenset({
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp",
+    ".zip", ".gz", ".xz", ".7z",
+    ".docx", ".xlsx", ".pptx",
+    ".mp3", ".mp4", ".mov", ".avi",
+})
+
+def link_or_copy(src, dst):
+    # Hardlink within the session directory so no bytes are copied; fall back
+    # to a real copy across filesystems. Linked files are never written to
+    # in place, so sharing the inode is safe.
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # rename() between two links to one file is a no-op and would leave
+        # the temporary link behind
+        return
+    # Unique per call so concurrent links to the same destination name
+    # cannot pick up each other's temporary file
+    tmp_path = Path(dst).with_name(f".{Path(dst).name}.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(src, tmp_path)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
 def compress_pdf(input_path, output_path, quality="Recommended"):
-    quality_flag = QUALITY_MAP.get(quality, "/ebook")
-    extra_flags = DPI_FLAGS.get(quality, [])
+    quality_args = GS_QUALITY_ARGS.get(quality, GS_QUALITY_ARGS["Recommended"])
     try:
-        subprocess.run([
-            "gs",
-            "-sDEVICE=pdfwrite",
-            "-dCompatibilityLevel=1.4",
-            f"-dPDFSETTINGS={quality_flag}",
-            *extra_flags,
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            f"-sOutputFile={output_path}",
-            str(input_path)
-        ], check=True)
+        subprocess.run(
+            [*GS_ARGS, *quality_args, f"-sOutputFile={output_path}", str(input_path)],
+            check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
     except subprocess.CalledProcessError:
-        shutil.copy(input_path, output_path)
+        return None
+    return os.path.getsize(output_path)
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFSIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def compress_pdf_in_place(fpaths, digest, original_size, quality="Recommended"):
+    # Compressed outputs are cached per session by content and level, so
+    # identical PDFs and re-runs at the same level skip gs entirely
+    cached = Path(CACHE_DIR) / f"{digest}_{quality}.pdf"
+    if not cached.exists():
+        tmp_path = cached.with_suffix(".tmp")
+        compressed_size = compress_pdf(fpaths[0], tmp_path, quality)
+        if compressed_size is None:
+            # gs failed: leave the originals untouched and don't cache the
+            # failure, so the next run tries gs again
+            tmp_path.unlink(missing_ok=True)
+            return
+        # Already-optimized PDFs can come out of gs larger; keep the original
+        if compressed_size >= original_size:
+            link_or_copy(fpaths[0], tmp_path)
+        os.replace(tmp_path, cached)
+    for fpath in fpaths:
+        link_or_copy(cached, fpath)
+
+def prune_cache(keep_digests):
+    # Keep results only for the PDFs in the current batch so the cache never
+    # outgrows what a re-run of the same files could reuse
+    with os.scandir(CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.split("_", 1)[0] not in keep_digests:
+                os.unlink(entry.path)
+
+def gather_all_files(directory):
+    # Yields DirEntry objects: the file type comes from the directory read,
+    # and callers only pay for a stat on the entries they keep
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    yield entry
+
+def reset_dir(path):
+    # Renaming is O(1) on the same filesystem; the actual delete runs in the
+    # background so a new batch does not wait on the previous one's cleanup
+    if os.path.exists(path):
+        trash = f"{path}.trash.{uuid.uuid4().hex}"
+        os.rename(path, trash)
+        threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={"ignore_errors": True}, daemon=True).start()
+    os.makedirs(path, exist_ok=True)
 
 def extract_zip(file, destination):
     with zipfile.ZipFile(file, 'r') as zip_ref:
         zip_ref.extractall(destination)
 
-def zip_files_with_structure(base_folder):
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(base_folder):
-            for f in files:
-                full_path = Path(root) / f
-                relative_path = full_path.relative_to(base_folder)
-                zf.write(full_path, arcname=str(relative_path))
-    zip_buffer.seek(0)
-    return zip_buffer
+def zip_files_with_structure(base_folder, zip_path):
+    # Carry each directory's archive prefix down the walk so arcnames are
+    # plain string joins rather than Path.relative_to per file
+    stack = [("", str(base_folder))]
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        while stack:
+            prefix, directory = stack.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((f"{prefix}{entry.name}/", entry.path))
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() in STORED_EXTS:
+                        compress_type = zipfile.ZIP_STORED
+                    else:
+                        compress_type = zipfile.ZIP_DEFLATED
+                    zf.write(entry.path, arcname=prefix + entry.name, compress_type=compress_type)
+    return zip_path
 
 def process_files(files, level):
-    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    reset_dir(OUTPUT_DIR)
+    # The session tree is only created here, per batch: reset_dir makes
+    # OUTPUT_DIR and its parents, and gs results are cached beside it
+    os.makedirs(CACHE_DIR, exist_ok=True)
     temp_dir = Path(OUTPUT_DIR)
 
     # Step 1: Save and extract ZIPs
     for file in files:
-        ext = file.name.split(".")[-1].lower()
-        path = temp_dir / file.name
-        with open(path, "wb") as f:
-            f.write(file.getbuffer())
-        if ext == "zip":
-            extract_zip(path, temp_dir)
-            path.unlink()
-
-    # Step 2: Count total files for progress bar
-    all_files = []
-    for root, _, file_list in os.walk(temp_dir):
-        for fname in file_list:
-            all_files.append(Path(root) / fname)
+        ext = os.path.splitext(file.name)[1].lower()
+        file.seek(0)
+        if ext in ARCHIVE_EXTS:
+            extract_zip(file, temp_dir)
+            continue
+        with open(temp_dir / file.name, "wb") as f:
+            shutil.copyfileobj(file, f, COPY_BUFSIZE)
+
+    # Step 2: Collect PDFs for compression
+    pdf_files = [
+        (Path(entry.path), entry.stat().st_size) for entry in gather_all_files(temp_dir)
+        if entry.name.lower().endswith(".pdf")
+    ]
 
     progress = st.progress(0)
-    total = len(all_files)
-
-    # Step 3: Process files with progress tracking
-    for i, fpath in enumerate(all_files):
-        if fpath.suffix.lower() == ".pdf":
-            out_path = fpath.parent / f"compressed_{fpath.name}"
-            compress_pdf(fpath, out_path, level)
-            fpath.unlink()
-            out_path.rename(fpath)
-        progress.progress((i + 1) / total)
-
+    total = len(pdf_files)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Step 3: Group identical PDFs so each distinct file is compressed once
+        groups = {}
+        sizes = {}
+        digests = executor.map(file_digest, [fpath for fpath, _ in pdf_files])
+        for (fpath, size), digest in zip(pdf_files, digests):
+            groups.setdefault(digest, []).append(fpath)
+            sizes[digest] = size
+        prune_cache(groups)
+
+        # Step 4: Run one gs process per distinct PDF across all cores, largest
+        # first so a big file never starts last and holds up the whole batch;
+        # progress is reported from this thread since Streamlit elements are
+        # not thread-safe
+        by_size = sorted(groups, key=sizes.get, reverse=True)
+        futures = {
+            executor.submit(compress_pdf_in_place, groups[digest], digest, sizes[digest], level): len(groups[digest])
+            for digest in by_size
+        }
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += futures[future]
+                progress.progress(done / total)
+        except BaseException:
+            # A failed job or a Streamlit rerun stops the batch; drop the gs
+            # runs that have not started instead of finishing them unseen
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    # A batch without PDFs never enters the loop above
+    progress.progress(1.0)
     return temp_dir
 
 # --- Streamlit UI ---
@@ -110,111 +244,7 @@ if uploaded and st.button("🚀 Compress & Download"):
     with st.spinner("Processing your files..."):
         output_folder = process_files(uploaded, level)
 
-    zip_buffer = zip_files_with_structure(output_folder)
-    st.success("✅ Done! Your compressed files are ready.")
-    st.download_button("📦 Download ZIP", zip_buffer, file_name="Compressed_Structured.zip", mime="application/zip")
-import streamlit as st
-import os
-import shutil
-import subprocess
-from pathlib import Path
-import uuid
-from io import BytesIO
-import zipfile
-
-# Setup persistent session directory
-SESSION_ID = st.session_state.get("session_id", str(uuid.uuid4()))
-st.session_state["session_id"] = SESSION_ID
-BASE_TEMP_DIR = f"temp_storage_{SESSION_ID}"
-INPUT_DIR = os.path.join(BASE_TEMP_DIR, "input")
-OUTPUT_DIR = os.path.join(BASE_TEMP_DIR, "output")
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-QUALITY_MAP = {
-    "Recommended": "/ebook",
-    "High": "/screen",
-    "Ultra": "/screen"
-}
-
-DPI_FLAGS = {
-    "Ultra": ["-dDownsampleColorImages=true", "-dColorImageResolution=50"]
-}
-
-def compress_pdf(input_path, output_path, quality="Recommended"):
-    quality_flag = QUALITY_MAP.get(quality, "/ebook")
-    extra_flags = DPI_FLAGS.get(quality, [])
-    try:
-        subprocess.run([
-            "gs",
-            "-sDEVICE=pdfwrite",
-            "-dCompatibilityLevel=1.4",
-            f"-dPDFSETTINGS={quality_flag}",
-            *extra_flags,
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            f"-sOutputFile={output_path}",
-            str(input_path)
-        ], check=True)
-    except subprocess.CalledProcessError:
-        shutil.copy(input_path, output_path)
-
-def extract_zip(file, destination):
-    with zipfile.ZipFile(file, 'r') as zip_ref:
-        zip_ref.extractall(destination)
-
-def zip_files_with_structure(base_folder):
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(base_folder):
-            for f in files:
-                full_path = Path(root) / f
-                relative_path = full_path.relative_to(base_folder)
-                zf.write(full_path, arcname=str(relative_path))
-    zip_buffer.seek(0)
-    return zip_buffer
-
-def process_files(files, level):
-    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    temp_dir = Path(OUTPUT_DIR)
-
-    for file in files:
-        ext = file.name.split(".")[-1].lower()
-        path = temp_dir / file.name
-        with open(path, "wb") as f:
-            f.write(file.getbuffer())
-        if ext == "zip":
-            extract_zip(path, temp_dir)
-            path.unlink()
-
-    for root, _, files_in_dir in os.walk(temp_dir):
-        for name in files_in_dir:
-            fpath = Path(root) / name
-            if fpath.suffix.lower() == ".pdf":
-                out_path = fpath.parent / f"compressed_{fpath.name}"
-                compress_pdf(fpath, out_path, level)
-                fpath.unlink()
-                out_path.rename(fpath)
-
-    return temp_dir
-
-# Streamlit UI
-st.set_page_config(page_title="Smart File Compressor", layout="wide")
-st.title("📂 Compress Files (PDFs, ZIPs, etc.)")
-
-st.sidebar.header("Compression Settings")
-level = st.sidebar.selectbox("Choose PDF Compression Level", ["Recommended", "High", "Ultra"])
-
-st.markdown("Upload files to compress all PDFs according to the selected level and retain folder structure.")
-
-uploaded = st.file_uploader("📁 Upload files", accept_multiple_files=True)
-
-if uploaded and st.button("🚀 Compress & Download"):
-    with st.spinner("Processing..."):
-        output_folder = process_files(uploaded, level)
-
-    zip_buffer = zip_files_with_structure(output_folder)
+    zip_path = zip_files_with_structure(output_folder, ZIP_PATH)
     st.success("✅ Done! Your compressed files are ready.")
-    st.download_button("📦 Download ZIP", zip_buffer, file_name="Compressed_Structured.zip", mime="application/zip")
+    with open(zip_path, "rb") as zip_file:
+        st.download_button("📦 Download ZIP", zip_file, file_name="Compressed_Structured.zip", mime="application/zip")